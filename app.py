@@ -1,12 +1,12 @@
 import streamlit as st
 import os
-import subprocess
-import tempfile
-import base64
 from pathlib import Path
 import platform
 import re
 
+# subprocess/tempfile/asyncio/hashlib/shutil are imported lazily inside the
+# functions that need them, keeping them off the script's per-rerun hot path
+
 st.set_page_config(
     page_title="LilyPond to PDF Converter",
     page_icon="🎵",
@@ -39,151 +39,369 @@ def extract_title_from_lilypond(ly_content):
     
     return None
 
-# Check if LilyPond is installed on the server
-@st.cache_resource
-def find_lilypond():
-    """Attempt to find the LilyPond executable on the system."""
-    try:
-        # Try to get LilyPond version which will fail if not installed
-        result = subprocess.run(['lilypond', '--version'], 
-                                capture_output=True, text=True, check=False)
-        if result.returncode == 0:
-            return 'lilypond'  # It's in the PATH
-    except FileNotFoundError:
-        pass
-        
-    # Common installation paths to check
-    common_paths = []
-    
-    # Windows common paths
-    if os.name == 'nt':
-        program_files = os.environ.get('PROGRAMFILES', 'C:\\Program Files')
-        program_files_x86 = os.environ.get('PROGRAMFILES(X86)', 'C:\\Program Files (x86)')
-        
-        for base_dir in [program_files, program_files_x86]:
-            common_paths.extend([
-                os.path.join(base_dir, 'LilyPond', 'usr', 'bin', 'lilypond.exe'),
-                os.path.join(base_dir, 'LilyPond', 'bin', 'lilypond.exe')
-            ])
-    
-    # macOS common paths
-    elif platform.system() == 'darwin':
-        common_paths.extend([
+# Platform facts resolved once at import; the finders all branch on these
+_PROGRAM_FILES = os.environ.get('PROGRAMFILES', 'C:\\Program Files')
+_PROGRAM_FILES_X86 = os.environ.get('PROGRAMFILES(X86)', 'C:\\Program Files (x86)')
+if os.name == 'nt':
+    _PLATFORM = 'windows'
+elif platform.system().lower() == 'darwin':
+    _PLATFORM = 'darwin'
+else:
+    _PLATFORM = 'linux'
+
+# Common installation paths per platform for everything the app depends on
+SEARCH_PATHS = {
+    'lilypond': {
+        'windows': [
+            os.path.join(base_dir, sub_dir, 'lilypond.exe')
+            for base_dir in (_PROGRAM_FILES, _PROGRAM_FILES_X86)
+            for sub_dir in (os.path.join('LilyPond', 'usr', 'bin'),
+                            os.path.join('LilyPond', 'bin'))
+        ],
+        'darwin': [
             '/Applications/LilyPond.app/Contents/Resources/bin/lilypond',
             os.path.expanduser('~/Applications/LilyPond.app/Contents/Resources/bin/lilypond')
-        ])
-    
-    # Linux common paths
-    else:
-        common_paths.extend([
+        ],
+        'linux': [
             '/usr/bin/lilypond',
             '/usr/local/bin/lilypond'
-        ])
-    
-    # Check each path
-    for path in common_paths:
-        if os.path.isfile(path) and os.access(path, os.X_OK):
-            return path
-            
-    return None
+        ]
+    },
+    'fluidsynth': {
+        'windows': [
+            os.path.join(_PROGRAM_FILES, 'FluidSynth', 'bin', 'fluidsynth.exe')
+        ],
+        'darwin': [
+            '/usr/local/bin/fluidsynth',
+            '/opt/homebrew/bin/fluidsynth'
+        ],
+        'linux': [
+            '/usr/bin/fluidsynth',
+            '/usr/local/bin/fluidsynth'
+        ]
+    },
+    'ffmpeg': {
+        'windows': [
+            os.path.join(_PROGRAM_FILES, 'ffmpeg', 'bin', 'ffmpeg.exe')
+        ],
+        'darwin': [
+            '/usr/local/bin/ffmpeg',
+            '/opt/homebrew/bin/ffmpeg'
+        ],
+        'linux': [
+            '/usr/bin/ffmpeg',
+            '/usr/local/bin/ffmpeg'
+        ]
+    },
+    'soundfont_sf2': {
+        'windows': [],
+        'darwin': [
+            '/usr/local/share/soundfonts/default.sf2',
+            '/opt/homebrew/share/soundfonts/default.sf2'
+        ],
+        'linux': [
+            '/usr/share/sounds/sf2/FluidR3_GM.sf2',
+            '/usr/share/sounds/sf2/default-GM.sf2',
+            '/usr/share/soundfonts/FluidR3_GM.sf2',
+            '/usr/share/soundfonts/default.sf2',
+            '/usr/local/share/soundfonts/default.sf2'
+        ]
+    }
+}
+
+# Resolved paths persist here across restarts so freshly started workers can
+# skip the PATH and filesystem scans entirely
+_PATHS_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'lilypond_streamlit', 'paths.json')
+
+def _load_path_cache():
+    """Read the persisted name -> path mapping, tolerating a missing/corrupt file."""
+    import json
+
+    try:
+        with open(_PATHS_CACHE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_path_cache(cache):
+    """Persist the name -> path mapping; failures just mean a rescan next boot."""
+    import json
+
+    try:
+        os.makedirs(os.path.dirname(_PATHS_CACHE_FILE), exist_ok=True)
+        with open(_PATHS_CACHE_FILE, 'w') as f:
+            json.dump(cache, f)
+    except OSError:
+        pass
+
+def _find(name, executable=True):
+    """Locate name via the persisted cache, PATH (executables), and SEARCH_PATHS."""
+    import shutil
+
+    # A cached path that still passes a single access check skips the scan;
+    # a stale one (tool moved/uninstalled) falls through and gets rewritten
+    cache = _load_path_cache()
+    cached_path = cache.get(name)
+    if cached_path is not None and os.path.isfile(cached_path) and \
+            (not executable or os.access(cached_path, os.X_OK)):
+        return cached_path
+
+    found = None
+    if executable:
+        # PATH lookup in pure Python; no need to spawn a process just to probe
+        found = shutil.which(name)
+
+    if found is None:
+        for path in SEARCH_PATHS[name][_PLATFORM]:
+            if os.path.isfile(path) and (not executable or os.access(path, os.X_OK)):
+                found = path
+                break
+
+    if found is not None:
+        cache[name] = found
+        _save_path_cache(cache)
+
+    return found
+
+# Check if LilyPond is installed on the server
+@st.cache_resource
+def find_lilypond():
+    """Attempt to find the LilyPond executable on the system."""
+    return _find('lilypond')
+
+# The audio stack (FluidSynth + ffmpeg + SoundFont) is only needed once a
+# score actually produces MIDI, so its lookups are deferred until then and
+# share one memoized entry instead of three startup scans
+_audio_stack = None
+
+def _find_audio_stack():
+    """Locate FluidSynth, ffmpeg, and a GM SoundFont, memoized per process.
+
+    Plain memoization rather than st.cache_resource so pool workers can call
+    it too; the persistent paths.json cache makes a first lookup cheap anyway.
+    """
+    global _audio_stack
+    if _audio_stack is None:
+        _audio_stack = (_find('fluidsynth'),
+                        _find('ffmpeg'),
+                        _find('soundfont_sf2', executable=False))
+    return _audio_stack
 
 lilypond_path = find_lilypond()
 
-# Display LilyPond status
-if lilypond_path:
-    st.success(f"✅ LilyPond found at: {lilypond_path}")
-else:
-    st.error("❌ LilyPond not found. You need to install LilyPond on the server running this app.")
-    st.info("Download LilyPond from [lilypond.org](https://lilypond.org/download.html)")
+# Probe once per server process for which speed flags LilyPond supports
+@st.cache_resource
+def probe_lilypond_flags():
+    """Build the extra LilyPond flags, checking version for Cairo backend support."""
+    import subprocess
 
-# Piano sheet sample
-piano_sheet = r"""\version "2.20.0"
+    if lilypond_path is None:
+        return []
 
-\header {
-  title = "Ascension"
-  subtitle = "An Epic Piano Journey"
-  composer = "Composed for You"
-}
+    # Point-and-click links are useless in a web converter and bloat the PDF;
+    # job-count lets LilyPond engrave multi-\book scores in parallel
+    flags = ['-dno-point-and-click', f'-djob-count={os.cpu_count() or 1}']
 
-\paper {
-  #(set-paper-size "letter")
-}
+    result = subprocess.run([lilypond_path, '--version'],
+                            capture_output=True, text=True, check=False)
+    version_match = re.search(r'(\d+)\.(\d+)', result.stdout)
+    if version_match and (int(version_match.group(1)), int(version_match.group(2))) >= (2, 25):
+        # The Cairo backend (2.25+) is faster and smaller than PostScript
+        flags.append('-dbackend=cairo')
 
-global = {
-  \key d \major
-  \time 4/4
-  \tempo "With passion" 4 = 72
-}
+    return flags
 
-upper = \relative c'' {
-  \global
-  \clef treble
-  
-  % Introduction - Majestic and contemplative
-  \partial 4 a4\mp |
-  <d fis a>2. <cis e a>4 |
-  <b d g>2. <a d fis>4 |
-  <g b e>2 <fis a d>2 |
-  <e a cis>2. a,4\< |
-  
-  <d fis a>2.\mf <e g b>4 |
-  <fis a d>2. <g b e>4 |
-  <a cis e>2 <b d fis>2 |
-  <a cis e>2. r4\! |
-  
-  % Main theme - Hopeful and building
-  d,4\mp\< fis a d |
-  cis4. b8 a4 fis |
-  b4. a8 g4 d |
-  e4. fis8 g4\mf a\> |
-  
-  d,4\mp fis a d |
-  e4. d8 cis4 a |
-  b4. a8 g4 e |
-  fis2\> d2\mp\! |
-  
-  % First few measures of the piece for brevity
-  \bar "|."
-}
+lilypond_flags = probe_lilypond_flags()
 
-lower = \relative c {
-  \global
-  \clef bass
-  
-  % Introduction
-  \partial 4 r4 |
-  d4 a' d, a' |
-  g,4 d' g, d' |
-  e,4 b' e, b' |
-  a,4 e' a, e' |
-  
-  d4 a' d, a' |
-  d,4 a' d, a' |
-  a,4 e' a, e' |
-  a,4 e' a, e' |
-  
-  % Main theme
-  d4 a' fis a |
-  a,4 e' a, e' |
-  g,4 d' g, d' |
-  a4 e' a, e' |
-  
-  d4 a' fis a |
-  a,4 e' a, e' |
-  g,4 d' g, d' |
-  a4 d fis a |
-  
-  \bar "|."
-}
+# Warm up LilyPond once per server process. LilyPond has no resident/server
+# mode, so the dominant cold-start cost we can actually avoid is the first
+# run's font-cache build: compile a trivial score in the background at startup
+# so the first real conversion pays only engraving time.
+@st.cache_resource
+def warm_lilypond():
+    """Kick off a throwaway background compile to pre-build LilyPond's font cache."""
+    import subprocess
+    import tempfile
+
+    if lilypond_path is None:
+        return None
+    warmup_dir = tempfile.mkdtemp(prefix="lilypond_warmup_")
+    warmup_ly_path = os.path.join(warmup_dir, "warmup.ly")
+    with open(warmup_ly_path, 'w') as f:
+        f.write('\\version "2.20.0"\n{ c4 }\n')
+    # Fire and forget: the process exits on its own, leaving the cache warm
+    return subprocess.Popen(
+        [lilypond_path, *lilypond_flags, '--output=' + warmup_dir, warmup_ly_path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+warm_lilypond()
+
+# Plain module-level compile routine so it can also run inside pool workers
+def _compile_ly(ly_content):
+    """Compile LilyPond source to PDF/MIDI/audio bytes, reusing cached output for identical input.
+
+    Returns (pdf_data, midi_data, audio_data, audio_ext); audio is Opus-compressed
+    .ogg when ffmpeg is available, uncompressed .wav otherwise.
+    """
+    import asyncio
+    import hashlib
+    import tempfile
+
+    content_hash = hashlib.blake2b(ly_content.encode()).hexdigest()
+    cache_dir = os.path.join(tempfile.gettempdir(), "streamlit_lilypond_cache")
+    os.makedirs(cache_dir, exist_ok=True)
+
+    cached_pdf_path = os.path.join(cache_dir, f"{content_hash}.pdf")
+    cached_midi_path = os.path.join(cache_dir, f"{content_hash}.midi")
+
+    # Cache hit: return the previously compiled output without running LilyPond
+    if os.path.exists(cached_pdf_path):
+        pdf_data = Path(cached_pdf_path).read_bytes()
+        midi_data = Path(cached_midi_path).read_bytes() if os.path.exists(cached_midi_path) else None
+        audio_data = None
+        audio_ext = None
+        for ext in ('ogg', 'wav'):
+            cached_audio_path = os.path.join(cache_dir, f"{content_hash}.{ext}")
+            if os.path.exists(cached_audio_path):
+                audio_data = Path(cached_audio_path).read_bytes()
+                audio_ext = ext
+                break
+        return pdf_data, midi_data, audio_data, audio_ext
+
+    # Cache miss: run LilyPond in a temporary directory.
+    # Prefer tmpfs (/dev/shm) so LilyPond's intermediate files never hit a real
+    # disk; on Windows/macOS there is no /dev/shm and we fall back to the default.
+    tmpfs_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    with tempfile.TemporaryDirectory(dir=tmpfs_dir) as temp_dir:
+        temp_pdf_path = os.path.join(temp_dir, "score.pdf")
+        temp_midi_path = os.path.join(temp_dir, "score.midi")
+
+        # Decided by the render task once MIDI appears and the audio stack
+        # has been resolved; stays None for PDF-only scores
+        temp_audio_path = None
+        audio_ext = None
+
+        env = os.environ.copy()
+        if tmpfs_dir is not None:
+            env['TMPDIR'] = tmpfs_dir
+
+        # Run LilyPond and FluidSynth concurrently: the MIDI file is written
+        # partway through the compile, so WAV rendering overlaps with the rest
+        # of the PDF engraving instead of running after it.
+        async def _compile_and_render():
+            # Feed the source over stdin ('-') rather than writing a .ly file
+            # just for LilyPond to read back; the tmpdir only holds its outputs.
+            # The explicit 'score' output basename keeps the filenames stdin
+            # would otherwise derive from '-'.
+            lily_proc = await asyncio.create_subprocess_exec(
+                lilypond_path, *lilypond_flags,
+                '--output=' + os.path.join(temp_dir, 'score'), '-',
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                env=env
+            )
+
+            async def _render_audio():
+                nonlocal temp_audio_path, audio_ext
+
+                # Wait for the MIDI file to appear while LilyPond keeps engraving
+                while not os.path.exists(temp_midi_path):
+                    if lily_proc.returncode is not None:
+                        return  # LilyPond finished without producing MIDI
+                    await asyncio.sleep(0.1)
+
+                # Only scores that actually emit MIDI pay for the audio-stack
+                # lookup; PDF-only conversions never touch it
+                fluidsynth_path, ffmpeg_path, soundfont_path = _find_audio_stack()
+                if fluidsynth_path is None or soundfont_path is None:
+                    return
+
+                audio_ext = 'ogg' if ffmpeg_path is not None else 'wav'
+                temp_audio_path = os.path.join(temp_dir, f"score.{audio_ext}")
+
+                if ffmpeg_path is not None:
+                    # Pipe raw PCM from FluidSynth straight into an Opus encode;
+                    # the uncompressed audio never touches disk
+                    fluid_proc = await asyncio.create_subprocess_exec(
+                        fluidsynth_path, '-ni', soundfont_path, temp_midi_path,
+                        '-F', '-', '-T', 'raw', '-r', '44100',
+                        stdout=asyncio.subprocess.PIPE,
+                        stderr=asyncio.subprocess.DEVNULL,
+                        env=env
+                    )
+                    ffmpeg_proc = await asyncio.create_subprocess_exec(
+                        ffmpeg_path, '-y', '-f', 's16le', '-ar', '44100', '-ac', '2',
+                        '-i', '-', '-c:a', 'libopus', temp_audio_path,
+                        stdin=asyncio.subprocess.PIPE,
+                        stdout=asyncio.subprocess.DEVNULL,
+                        stderr=asyncio.subprocess.DEVNULL,
+                        env=env
+                    )
+                    while True:
+                        chunk = await fluid_proc.stdout.read(65536)
+                        if not chunk:
+                            break
+                        ffmpeg_proc.stdin.write(chunk)
+                        await ffmpeg_proc.stdin.drain()
+                    ffmpeg_proc.stdin.close()
+                    await asyncio.gather(fluid_proc.wait(), ffmpeg_proc.wait())
+                else:
+                    fluid_proc = await asyncio.create_subprocess_exec(
+                        fluidsynth_path, '-ni', soundfont_path, temp_midi_path,
+                        '-F', temp_audio_path, '-r', '44100',
+                        stdout=asyncio.subprocess.DEVNULL,
+                        stderr=asyncio.subprocess.DEVNULL,
+                        env=env
+                    )
+                    await fluid_proc.wait()
+
+            audio_task = asyncio.create_task(_render_audio())
+
+            _, lily_stderr = await lily_proc.communicate(input=ly_content.encode())
+            await audio_task
+            return lily_proc.returncode, lily_stderr.decode()
+
+        returncode, lily_stderr = asyncio.run(_compile_and_render())
+
+        if returncode != 0:
+            raise RuntimeError(f"LilyPond Error: {lily_stderr}")
+
+        if not os.path.exists(temp_pdf_path):
+            raise RuntimeError("LilyPond did not generate a PDF.")
+
+        # Read each output exactly once; everything downstream reuses these bytes
+        pdf_data = Path(temp_pdf_path).read_bytes()
+        midi_data = Path(temp_midi_path).read_bytes() if os.path.exists(temp_midi_path) else None
+        audio_data = None
+        if temp_audio_path is not None and os.path.exists(temp_audio_path):
+            audio_data = Path(temp_audio_path).read_bytes()
+
+    # Publish to the cache atomically so concurrent sessions never see partial files
+    for data, suffix in [(pdf_data, 'pdf'), (midi_data, 'midi'), (audio_data, audio_ext)]:
+        if data is not None:
+            temp_cache_path = os.path.join(cache_dir, f".{content_hash}.{suffix}.tmp")
+            Path(temp_cache_path).write_bytes(data)
+            os.replace(temp_cache_path, os.path.join(cache_dir, f"{content_hash}.{suffix}"))
+
+    return pdf_data, midi_data, audio_data, audio_ext
+
+# Compile LilyPond source, caching results in memory on top of the disk cache
+@st.cache_data(max_entries=128)
+def compile_ly(ly_content):
+    """Cached front-end for _compile_ly used by the single-file flow."""
+    return _compile_ly(ly_content)
+
+# Display LilyPond status
+if lilypond_path:
+    st.success(f"✅ LilyPond found at: {lilypond_path}")
+else:
+    st.error("❌ LilyPond not found. You need to install LilyPond on the server running this app.")
+    st.info("Download LilyPond from [lilypond.org](https://lilypond.org/download.html)")
 
-\score {
-  \new PianoStaff <<
-    \new Staff = "upper" \upper
-    \new Staff = "lower" \lower
-  >>
-  \layout { }
-  \midi { }
-}"""
 
 # Create tabs
 tab1, tab2 = st.tabs(["Input Text", "Upload File"])
@@ -199,6 +417,12 @@ if 'midi_data' not in st.session_state:
     st.session_state.midi_data = None
 if 'midi_filename' not in st.session_state:
     st.session_state.midi_filename = None
+if 'audio_data' not in st.session_state:
+    st.session_state.audio_data = None
+if 'audio_filename' not in st.session_state:
+    st.session_state.audio_filename = None
+if 'audio_mime' not in st.session_state:
+    st.session_state.audio_mime = None
 
 with tab1:
     # Text input area
@@ -206,7 +430,8 @@ with tab1:
     
     # Button to load sample
     if st.button("Load Sample"):
-        ly_text = piano_sheet
+        from samples import piano_sheet
+        ly_text = piano_sheet()
         # Clear previous generated files when loading new content
         st.session_state.pdf_generated = False
     else:
@@ -229,9 +454,13 @@ with tab1:
 
 with tab2:
     # File upload
-    st.subheader("Upload LilyPond File")
-    uploaded_file = st.file_uploader("Choose a LilyPond file", type=['ly'])
-    
+    st.subheader("Upload LilyPond Files")
+    uploaded_files = st.file_uploader("Choose LilyPond files", type=['ly'],
+                                      accept_multiple_files=True)
+
+    # A single upload goes through the normal flow; several are batch-compiled
+    uploaded_file = uploaded_files[0] if len(uploaded_files) == 1 else None
+
     # Clear previous generated files if a new file is uploaded
     if uploaded_file is not None and 'last_uploaded_file' in st.session_state:
         if st.session_state.last_uploaded_file != uploaded_file.name:
@@ -252,13 +481,19 @@ with tab2:
             default_name = os.path.splitext(uploaded_file.name)[0]
     else:
         default_name = "output"
-        
-    output_filename_file = st.text_input("Output Filename", value=default_name, key="file_output")
 
-# Display download buttons if files have been generated
-if st.session_state.pdf_generated:
+    if len(uploaded_files) > 1:
+        st.caption(f"{len(uploaded_files)} files selected — each will be compiled "
+                   "in parallel and named after its title or filename.")
+        output_filename_file = default_name
+    else:
+        output_filename_file = st.text_input("Output Filename", value=default_name, key="file_output")
+
+# Download buttons and preview, shared by the normal rerun path and the
+# conversion branch so a fresh conversion renders inline without st.rerun()
+def render_results():
     st.success("Files generated successfully!")
-    
+
     # Create download buttons for both PDF and MIDI
     if st.session_state.pdf_data is not None:
         st.download_button(
@@ -268,7 +503,7 @@ if st.session_state.pdf_generated:
             mime="application/octet-stream",
             key="pdf_download"
         )
-    
+
     if st.session_state.midi_data is not None:
         st.download_button(
             label="Download MIDI",
@@ -277,95 +512,138 @@ if st.session_state.pdf_generated:
             mime="audio/midi",
             key="midi_download"
         )
-    
-    st.info("PDF preview is not available due to browser security restrictions. Please download the PDF to view it.")
+
+    if st.session_state.audio_data is not None:
+        st.audio(st.session_state.audio_data, format=st.session_state.audio_mime)
+        st.download_button(
+            label="Download Audio",
+            data=st.session_state.audio_data,
+            file_name=st.session_state.audio_filename,
+            mime=st.session_state.audio_mime,
+            key="audio_download"
+        )
+
+    # Preview straight from the in-memory bytes; no base64 data URI involved
+    if st.session_state.pdf_data is not None:
+        st.pdf(st.session_state.pdf_data)
+
+# Display download buttons if files have been generated
+results_shown = st.session_state.pdf_generated
+if results_shown:
+    render_results()
 
 # Convert buttons
 convert_text = st.button("Convert to PDF", key="convert_text", disabled=not lilypond_path)
-convert_file = st.button("Convert to PDF", key="convert_file", disabled=not lilypond_path or uploaded_file is None)
+convert_file = st.button("Convert to PDF", key="convert_file", disabled=not lilypond_path or not uploaded_files)
+
+# Batch processing: fan compiles out across cores, one worker per file
+if convert_file and len(uploaded_files) > 1 and lilypond_path:
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    progress_bar = st.progress(0.0, text="Compiling files...")
+    batch_results = []
+    max_workers = min(os.cpu_count() or 1, len(uploaded_files))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for f in uploaded_files:
+            content = f.getvalue().decode("utf-8")
+            base_name = extract_title_from_lilypond(content) or os.path.splitext(f.name)[0]
+            futures[executor.submit(_compile_ly, content)] = base_name
+
+        for done, future in enumerate(as_completed(futures), start=1):
+            base_name = futures[future]
+            try:
+                batch_results.append((base_name, future.result()))
+            except Exception as e:
+                batch_results.append((base_name, str(e)))
+            progress_bar.progress(done / len(futures),
+                                  text=f"Compiled {done}/{len(futures)} files")
+
+    st.session_state.batch_results = batch_results
+    progress_bar.empty()
+
+# Display batch results from session state so they survive reruns
+if st.session_state.get('batch_results'):
+    st.success("Batch conversion complete!")
+    for i, (base_name, result) in enumerate(st.session_state.batch_results):
+        if isinstance(result, str):
+            st.error(f"{base_name}: {result}")
+            continue
+        pdf_data, midi_data, audio_data, audio_ext = result
+        with st.expander(base_name):
+            st.download_button(
+                label="Download PDF",
+                data=pdf_data,
+                file_name=f"{base_name}.pdf",
+                mime="application/octet-stream",
+                key=f"batch_pdf_{i}"
+            )
+            if midi_data is not None:
+                st.download_button(
+                    label="Download MIDI",
+                    data=midi_data,
+                    file_name=f"{base_name}.midi",
+                    mime="audio/midi",
+                    key=f"batch_midi_{i}"
+                )
+            if audio_data is not None:
+                st.download_button(
+                    label="Download Audio",
+                    data=audio_data,
+                    file_name=f"{base_name}.{audio_ext}",
+                    mime="audio/ogg" if audio_ext == 'ogg' else "audio/wav",
+                    key=f"batch_audio_{i}"
+                )
 
 # Processing logic
-if (convert_text or convert_file) and lilypond_path:
+if (convert_text or (convert_file and uploaded_file is not None)) and lilypond_path:
     # Create a status container
     status_container = st.empty()
     status_container.info("Starting conversion...")
     
     try:
-        # Create a temporary directory
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Get LilyPond content
-            if convert_text:
-                ly_content = text_area
-                output_name = output_filename
-            else:  # convert_file
-                if uploaded_file is None:
-                    st.error("Please upload a LilyPond file.")
-                    st.stop()
-                    
-                # Read uploaded file
-                ly_content = uploaded_file.getvalue().decode("utf-8")
-                output_name = output_filename_file
-            
-            # Create temporary LilyPond file
-            temp_ly_path = os.path.join(temp_dir, "score.ly")
-            with open(temp_ly_path, 'w') as f:
-                f.write(ly_content)
-            
-            # Run LilyPond
-            status_container.info("Running LilyPond...")
-            result = subprocess.run(
-                [lilypond_path, '--output=' + temp_dir, temp_ly_path],
-                capture_output=True,
-                text=True
-            )
-            
-            if result.returncode != 0:
-                status_container.error(f"LilyPond Error: {result.stderr}")
-                st.stop()
-            
-            # Check if PDF was generated
-            temp_pdf_path = os.path.join(temp_dir, "score.pdf")
-            if not os.path.exists(temp_pdf_path):
-                status_container.error("LilyPond did not generate a PDF.")
+        # Get LilyPond content
+        if convert_text:
+            ly_content = text_area
+            output_name = output_filename
+        else:  # convert_file
+            if uploaded_file is None:
+                st.error("Please upload a LilyPond file.")
                 st.stop()
-            
-            # Copy to a more permanent location within the streamlit cache
-            cache_dir = os.path.join(tempfile.gettempdir(), "streamlit_lilypond_cache")
-            os.makedirs(cache_dir, exist_ok=True)
-            final_pdf_path = os.path.join(cache_dir, f"{output_name}.pdf")
-            
-            import shutil
-            shutil.copy2(temp_pdf_path, final_pdf_path)
-            
-            # Store PDF data in session state
-            with open(final_pdf_path, "rb") as pdf_file:
-                pdf_data = pdf_file.read()
-                st.session_state.pdf_data = pdf_data
-                st.session_state.pdf_filename = f"{output_name}.pdf"
-            
-            # Also generate MIDI if available
-            temp_midi_path = os.path.join(temp_dir, "score.midi")
-            if os.path.exists(temp_midi_path):
-                final_midi_path = os.path.join(cache_dir, f"{output_name}.midi")
-                shutil.copy2(temp_midi_path, final_midi_path)
-                
-                with open(final_midi_path, "rb") as midi_file:
-                    midi_data = midi_file.read()
-                    st.session_state.midi_data = midi_data
-                    st.session_state.midi_filename = f"{output_name}.midi"
-            else:
-                st.session_state.midi_data = None
-                st.session_state.midi_filename = None
-            
-            # Mark as successful
-            st.session_state.pdf_generated = True
-            
-            # Remove status message as we'll show success in the permanent UI
-            status_container.empty()
-            
-            # Force a rerun to show the download buttons
+
+            # Read uploaded file
+            ly_content = uploaded_file.getvalue().decode("utf-8")
+            output_name = output_filename_file
+
+        # Compile (served from the on-disk cache for repeat input)
+        status_container.info("Running LilyPond...")
+        pdf_data, midi_data, audio_data, audio_ext = compile_ly(ly_content)
+
+        # Store results in session state
+        st.session_state.pdf_data = pdf_data
+        st.session_state.pdf_filename = f"{output_name}.pdf"
+        st.session_state.midi_data = midi_data
+        st.session_state.midi_filename = f"{output_name}.midi" if midi_data is not None else None
+        st.session_state.audio_data = audio_data
+        st.session_state.audio_filename = f"{output_name}.{audio_ext}" if audio_data is not None else None
+        st.session_state.audio_mime = "audio/ogg" if audio_ext == 'ogg' else "audio/wav"
+
+        # Mark as successful so later natural reruns keep showing the results
+        st.session_state.pdf_generated = True
+
+        # Remove status message as we'll show success in the permanent UI
+        status_container.empty()
+
+        # Render inline rather than forcing a second full script pass; only
+        # when stale results were already drawn this run is a rerun needed to
+        # replace them (re-rendering here would duplicate widget keys)
+        if results_shown:
             st.rerun()
-    
+        else:
+            render_results()
+
+    except RuntimeError as e:
+        status_container.error(str(e))
     except Exception as e:
         st.error(f"Error during conversion: {str(e)}")
 